@@ -1,7 +1,8 @@
 import streamlit as st
 import os
-import tempfile
-from document_processor import DocumentProcessor
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from document_processor import DocumentProcessor, _extract_and_tokenize
 from rag_system import RAGSystem
 import time
 
@@ -28,30 +29,35 @@ st.markdown("""
         border-radius: 10px;
         margin-bottom: 2rem;
     }
-    .chat-message {
-        padding: 1rem;
-        border-radius: 10px;
-        margin-bottom: 1rem;
-    }
-    .user-message {
-        background-color: #e1f5fe;
-        border-left: 4px solid #2196f3;
-    }
-    .assistant-message {
-        background-color: #f3e5f5;
-        border-left: 4px solid #9c27b0;
-    }
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource(show_spinner=False)
+def get_process_pool():
+    """One worker pool per server process for parsing uploads.
+
+    Workers are spawned rather than forked: Streamlit serves sessions from
+    threads and torch is already loaded, neither of which survives a fork.
+    """
+    return ProcessPoolExecutor(max_workers=os.cpu_count(),
+                               mp_context=multiprocessing.get_context("spawn"))
+
 def initialize_session_state():
     """Initialize session state variables"""
     if 'rag_system' not in st.session_state:
+        # Per-session settings; the model, ChromaDB and FAISS index come from
+        # cached resources shared by all sessions
         st.session_state.rag_system = RAGSystem()
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history = []
     if 'documents_loaded' not in st.session_state:
         st.session_state.documents_loaded = False
+    if 'tokenized_documents' not in st.session_state:
+        # filename -> tokens and per-sentence token counts, for re-chunking
+        st.session_state.tokenized_documents = {}
+    if 'chunk_ids' not in st.session_state:
+        # filename -> ids of the chunks this session added for it
+        st.session_state.chunk_ids = {}
 
 def main():
     initialize_session_state()
@@ -78,6 +84,7 @@ def main():
                     2. Download and install
                     3. Run: `ollama pull llama2` or `ollama pull mistral`
                     """)
+            st.caption("Tip: start Ollama with `OLLAMA_NUM_PARALLEL=4 ollama serve` so batch questions are answered concurrently.")
         
         # File upload section
         st.subheader("Upload Documents")
@@ -102,32 +109,7 @@ def main():
     col1, col2 = st.columns([3, 1])
     
     with col1:
-        st.header("💬 Chat with your documents")
-        
-        # Chat history
-        chat_container = st.container()
-        with chat_container:
-            for message in st.session_state.chat_history:
-                if message['role'] == 'user':
-                    st.markdown(f'<div class="chat-message user-message"><strong>You:</strong> {message["content"]}</div>', unsafe_allow_html=True)
-                else:
-                    st.markdown(f'<div class="chat-message assistant-message"><strong>Assistant:</strong> {message["content"]}</div>', unsafe_allow_html=True)
-        
-        # Chat input
-        if st.session_state.documents_loaded:
-            user_question = st.text_input("Ask a question about your documents:", key="user_input")
-            
-            col_send, col_clear = st.columns([1, 1])
-            with col_send:
-                if st.button("Send", type="primary") and user_question:
-                    handle_question(user_question)
-            
-            with col_clear:
-                if st.button("Clear Chat"):
-                    st.session_state.chat_history = []
-                    st.rerun()
-        else:
-            st.info("👆 Please upload and process documents first to start chatting!")
+        chat_interface()
     
     with col2:
         st.header("🔧 Settings")
@@ -150,6 +132,42 @@ def main():
         top_k = st.slider("Top K Results", 1, 10, 3, help="Number of relevant chunks to retrieve")
         
         st.session_state.rag_system.update_settings(chunk_size=chunk_size, top_k=top_k)
+        
+        if st.session_state.tokenized_documents:
+            if st.button("Re-chunk Documents", help="Re-split this session's documents with the current chunk size without re-reading the files"):
+                rechunk_documents()
+
+@st.fragment
+def chat_interface():
+    """Chat panel; runs as a fragment so a chat turn only reruns this panel"""
+    st.header("💬 Chat with your documents")
+    
+    # Chat history; new turns are rendered into the same container above the input
+    messages = st.container()
+    with messages:
+        for message in st.session_state.chat_history:
+            with st.chat_message(message['role']):
+                st.markdown(message['content'])
+    
+    # Chat input
+    if st.session_state.documents_loaded:
+        if prompt := st.chat_input("Ask a question about your documents..."):
+            handle_question(prompt, messages)
+        
+        st.button("Clear Chat", on_click=clear_chat)
+        
+        with st.expander("📝 Ask several questions at once"):
+            batch_questions = st.text_area("One question per line", key="batch_input")
+            if st.button("Ask All"):
+                questions = [q.strip() for q in batch_questions.splitlines() if q.strip()]
+                if questions:
+                    handle_questions_batch(questions, messages)
+    else:
+        st.info("👆 Please upload and process documents first to start chatting!")
+
+def clear_chat():
+    """Reset the conversation"""
+    st.session_state.chat_history = []
 
 def process_documents(uploaded_files):
     """Process uploaded documents"""
@@ -157,29 +175,34 @@ def process_documents(uploaded_files):
     status_text = st.empty()
     
     try:
-        processor = DocumentProcessor()
         total_files = len(uploaded_files)
+        processor = DocumentProcessor(chunk_size=st.session_state.rag_system.chunk_size)
         
-        for i, uploaded_file in enumerate(uploaded_files):
-            status_text.text(f"Processing {uploaded_file.name}...")
-            
-            # Save uploaded file temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                tmp_file_path = tmp_file.name
-            
-            try:
-                # Process document
-                chunks = processor.process_document(tmp_file_path, uploaded_file.name)
-                
-                # Add to RAG system
-                st.session_state.rag_system.add_documents(chunks, uploaded_file.name)
-                
-            finally:
-                # Clean up temporary file
-                os.unlink(tmp_file_path)
-            
-            progress_bar.progress((i + 1) / total_files)
+        # Extract and tokenize straight from the uploaded bytes; both are CPU-bound,
+        # so several files are spread over the worker pool
+        status_text.text(f"Processing {total_files} file(s)...")
+        if total_files == 1:
+            uploaded_file = uploaded_files[0]
+            documents = [(0, _extract_and_tokenize(uploaded_file.getvalue(), uploaded_file.name))]
+        else:
+            futures = {
+                get_process_pool().submit(_extract_and_tokenize, uploaded_file.getvalue(), uploaded_file.name): i
+                for i, uploaded_file in enumerate(uploaded_files)
+            }
+            documents = ((futures[future], future.result()) for future in as_completed(futures))
+        
+        results = [None] * total_files
+        for done, (i, document) in enumerate(documents, start=1):
+            st.session_state.tokenized_documents[document['filename']] = document
+            results[i] = (processor.chunk_tokenized_document(document), document['filename'])
+            status_text.text(f"Processed {uploaded_files[i].name}")
+            progress_bar.progress(done / total_files)
+        
+        # Embed every file's chunks in one batch
+        status_text.text("Generating embeddings...")
+        ids_per_document = st.session_state.rag_system.add_documents_bulk(results)
+        for (_, filename), document_ids in zip(results, ids_per_document):
+            st.session_state.chunk_ids.setdefault(filename, []).extend(document_ids)
         
         st.session_state.documents_loaded = True
         status_text.text("✅ All documents processed successfully!")
@@ -189,21 +212,64 @@ def process_documents(uploaded_files):
     except Exception as e:
         st.error(f"Error processing documents: {str(e)}")
 
-def handle_question(question):
-    """Handle user question and generate response"""
+def rechunk_documents():
+    """Re-chunk already tokenized documents with the current chunk size and re-index them"""
+    documents = st.session_state.tokenized_documents
+    rag_system = st.session_state.rag_system
+    
+    with st.spinner(f"Re-chunking {len(documents)} document(s)..."):
+        try:
+            processor = DocumentProcessor(chunk_size=rag_system.chunk_size)
+            rechunked = [(processor.chunk_tokenized_document(document), filename)
+                         for filename, document in documents.items()]
+            # Index the new chunks before dropping the old ones so a failure
+            # never leaves the documents missing from the collection
+            ids_per_document = rag_system.add_documents_bulk(rechunked)
+            old_ids = [chunk_id for filename in documents
+                       for chunk_id in st.session_state.chunk_ids.get(filename, [])]
+            rag_system.remove_chunks(old_ids)
+            st.session_state.chunk_ids.update(
+                (filename, document_ids) for (_, filename), document_ids in zip(rechunked, ids_per_document)
+            )
+            st.success(f"✅ Re-chunked with chunk size {rag_system.chunk_size}")
+        except Exception as e:
+            st.error(f"Error re-chunking documents: {str(e)}")
+
+def handle_question(question, container):
+    """Handle user question and stream the response into the chat"""
     # Add user message to chat history
     st.session_state.chat_history.append({"role": "user", "content": question})
     
-    # Generate response
-    with st.spinner("Thinking..."):
+    with container:
+        with st.chat_message("user"):
+            st.markdown(question)
+        
+        # Render the answer as it streams in
+        with st.chat_message("assistant"):
+            try:
+                response = st.write_stream(st.session_state.rag_system.ask_question_stream(question))
+            except Exception as e:
+                response = f"Error generating response: {str(e)}"
+                st.markdown(response)
+    
+    st.session_state.chat_history.append({"role": "assistant", "content": response})
+
+def handle_questions_batch(questions, container):
+    """Answer several questions concurrently and append them to the chat"""
+    with st.spinner(f"Answering {len(questions)} questions..."):
         try:
-            response = st.session_state.rag_system.ask_question(question)
-            st.session_state.chat_history.append({"role": "assistant", "content": response})
+            responses = st.session_state.rag_system.ask_questions_batch(questions)
         except Exception as e:
-            error_msg = f"Error generating response: {str(e)}"
-            st.session_state.chat_history.append({"role": "assistant", "content": error_msg})
+            responses = [f"Error generating response: {str(e)}"] * len(questions)
     
-    st.rerun()
+    with container:
+        for question, response in zip(questions, responses):
+            st.session_state.chat_history.append({"role": "user", "content": question})
+            st.session_state.chat_history.append({"role": "assistant", "content": response})
+            with st.chat_message("user"):
+                st.markdown(question)
+            with st.chat_message("assistant"):
+                st.markdown(response)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,32 +1,143 @@
+import io
+import itertools
 import os
-from typing import List, Dict
-import PyPDF2
+import re
+from typing import List, Dict, Tuple
+import numpy as np
+import pypdfium2 as pdfium
 import docx
 import tiktoken
 
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+_SENT_SPLIT = re.compile(r'[.!?]+')
+_WS = re.compile(r'\s+')
+_HYPERSCAN_MIN_CHARS = 1_000_000  # Below this the compiled re is fast enough
+_NUMBA_MIN_SENTENCES = 10_000  # Below this the Python loop beats the JIT dispatch and cache load
+_hyperscan_db = None
+
+def _get_hyperscan_db():
+    """Compile the sentence delimiter pattern into a Hyperscan database once"""
+    global _hyperscan_db
+    if _hyperscan_db is None:
+        db = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+        db.compile(
+            expressions=[_SENT_SPLIT.pattern.encode()],
+            ids=[0],
+            flags=[hyperscan.HS_FLAG_SOM_LEFTMOST]
+        )
+        _hyperscan_db = db
+    return _hyperscan_db
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _pack_chunks_numba(lens: np.ndarray, chunk_size: int, chunk_overlap: int) -> np.ndarray:
+        """Native-code version of _pack_chunks returning an (n, 2) int32 array of ranges"""
+        # Only a sentence after the first can close a chunk, plus the final one
+        spans = np.empty((len(lens) + 1, 2), dtype=np.int32)
+        n_spans = 0
+        start = 0
+        end = 0
+        current_tokens = 0
+        
+        for sentence_tokens in lens:
+            if current_tokens + sentence_tokens > chunk_size and current_tokens > 0:
+                spans[n_spans, 0] = start
+                spans[n_spans, 1] = end
+                n_spans += 1
+                
+                if chunk_overlap > 0:
+                    start = max(start, end - chunk_overlap)
+                else:
+                    start = end
+            end += sentence_tokens
+            current_tokens = end - start
+        
+        if current_tokens > 0:
+            spans[n_spans, 0] = start
+            spans[n_spans, 1] = end
+            n_spans += 1
+        
+        return spans[:n_spans]
+else:
+    _pack_chunks_numba = None
+
+def _pack_chunks(lens: np.ndarray, chunk_size: int, chunk_overlap: int) -> np.ndarray:
+    """Group sentences into chunks, returning an (n, 2) int32 array of ranges into the flat tokens"""
+    if _pack_chunks_numba is not None and len(lens) >= _NUMBA_MIN_SENTENCES:
+        return _pack_chunks_numba(lens, chunk_size, chunk_overlap)
+    
+    spans = []
+    start = 0
+    end = 0
+    current_tokens = 0
+    
+    # Plain ints iterate several times faster than numpy scalars
+    for sentence_tokens in lens.tolist():
+        # If adding this sentence would exceed chunk size, save current chunk
+        if current_tokens + sentence_tokens > chunk_size and current_tokens > 0:
+            spans.append((start, end))
+            
+            # Start new chunk with the last chunk_overlap tokens of the previous one
+            if chunk_overlap > 0:
+                start = max(start, end - chunk_overlap)
+            else:
+                start = end
+        end += sentence_tokens
+        current_tokens = end - start
+    
+    # Add the last chunk
+    if current_tokens > 0:
+        spans.append((start, end))
+    
+    return np.array(spans, dtype=np.int32).reshape(-1, 2)
+
 class DocumentProcessor:
     def __init__(self, chunk_size: int = 500, chunk_overlap: int = 50):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.encoding = tiktoken.get_encoding("cl100k_base")
     
-    def process_document(self, file_path: str, filename: str) -> List[Dict]:
+    def process_document(self, file_bytes: bytes, filename: str) -> List[Dict]:
         """Process a document and return chunks with metadata"""
+        return self.chunk_tokenized_document(self.tokenize_document(file_bytes, filename))
+    
+    def tokenize_document(self, file_bytes: bytes, filename: str) -> Dict:
+        """Extract and tokenize a document so it can be re-chunked without re-parsing"""
         # Extract text based on file type
         file_extension = os.path.splitext(filename)[1].lower()
         
         if file_extension == '.pdf':
-            text = self._extract_pdf_text(file_path)
+            text = self._extract_pdf_text(file_bytes)
         elif file_extension == '.docx':
-            text = self._extract_docx_text(file_path)
+            text = self._extract_docx_text(file_bytes)
         elif file_extension == '.txt':
-            text = self._extract_txt_text(file_path)
+            text = self._extract_txt_text(file_bytes)
         else:
             raise ValueError(f"Unsupported file type: {file_extension}")
         
-        # Clean and chunk the text
+        # Clean and tokenize the text
         cleaned_text = self._clean_text(text)
-        chunks = self._chunk_text(cleaned_text)
+        tokens, lens = self._tokenize_sentences(cleaned_text)
+        
+        return {
+            'filename': filename,
+            'file_type': file_extension[1:],  # Remove the dot
+            'tokens': tokens,
+            'lens': lens
+        }
+    
+    def chunk_tokenized_document(self, document: Dict) -> List[Dict]:
+        """Chunk a tokenized document with the current chunk size"""
+        chunks = self._chunks_from_tokens(document['tokens'], document['lens'])
         
         # Create document chunks with metadata
         document_chunks = []
@@ -34,32 +145,31 @@ class DocumentProcessor:
             document_chunks.append({
                 'content': chunk,
                 'metadata': {
-                    'filename': filename,
+                    'filename': document['filename'],
                     'chunk_index': i,
                     'total_chunks': len(chunks),
-                    'file_type': file_extension[1:],  # Remove the dot
+                    'file_type': document['file_type'],
                     'chunk_size': len(chunk)
                 }
             })
         
         return document_chunks
     
-    def _extract_pdf_text(self, file_path: str) -> str:
+    def _extract_pdf_text(self, file_bytes: bytes) -> str:
         """Extract text from PDF file"""
-        text = ""
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
+            pdf = pdfium.PdfDocument(file_bytes)
+            try:
+                return "".join(page.get_textpage().get_text_range() + "\n" for page in pdf)
+            finally:
+                pdf.close()
         except Exception as e:
             raise Exception(f"Error reading PDF: {str(e)}")
-        return text
     
-    def _extract_docx_text(self, file_path: str) -> str:
+    def _extract_docx_text(self, file_bytes: bytes) -> str:
         """Extract text from DOCX file"""
         try:
-            doc = docx.Document(file_path)
+            doc = docx.Document(io.BytesIO(file_bytes))
             text = ""
             for paragraph in doc.paragraphs:
                 text += paragraph.text + "\n"
@@ -67,77 +177,85 @@ class DocumentProcessor:
         except Exception as e:
             raise Exception(f"Error reading DOCX: {str(e)}")
     
-    def _extract_txt_text(self, file_path: str) -> str:
+    def _extract_txt_text(self, file_bytes: bytes) -> str:
         """Extract text from TXT file"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
+            return file_bytes.decode('utf-8')
         except UnicodeDecodeError:
             # Try with different encoding if UTF-8 fails
-            with open(file_path, 'r', encoding='latin-1') as file:
-                return file.read()
+            return file_bytes.decode('latin-1')
         except Exception as e:
             raise Exception(f"Error reading TXT: {str(e)}")
     
     def _clean_text(self, text: str) -> str:
         """Clean and normalize text"""
-        # Remove excessive whitespace
-        text = ' '.join(text.split())
-        
-        # Remove empty lines and normalize
-        lines = [line.strip() for line in text.split('\n') if line.strip()]
-        return '\n'.join(lines)
+        # Collapse every whitespace run, newlines included, into a single space
+        return _WS.sub(' ', text).strip()
     
     def _chunk_text(self, text: str) -> List[str]:
         """Chunk text into smaller pieces using token-based splitting"""
+        tokens, lens = self._tokenize_sentences(text)
+        return self._chunks_from_tokens(tokens, lens)
+    
+    def _tokenize_sentences(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Tokenize text sentence by sentence, returning the flat tokens and per-sentence counts"""
         # Split into sentences first
         sentences = self._split_into_sentences(text)
+        if not sentences:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
         
-        chunks = []
-        current_chunk = ""
-        current_tokens = 0
-        
-        for sentence in sentences:
-            sentence_tokens = len(self.encoding.encode(sentence))
-            
-            # If adding this sentence would exceed chunk size, save current chunk
-            if current_tokens + sentence_tokens > self.chunk_size and current_chunk:
-                chunks.append(current_chunk.strip())
-                
-                # Start new chunk with overlap
-                if self.chunk_overlap > 0:
-                    overlap_text = self._get_overlap_text(current_chunk, self.chunk_overlap)
-                    current_chunk = overlap_text + " " + sentence
-                    current_tokens = len(self.encoding.encode(current_chunk))
-                else:
-                    current_chunk = sentence
-                    current_tokens = sentence_tokens
-            else:
-                current_chunk += " " + sentence
-                current_tokens += sentence_tokens
-        
-        # Add the last chunk
-        if current_chunk.strip():
-            chunks.append(current_chunk.strip())
+        # Tokenize every sentence in one call; the leading space stands in for
+        # the separator between sentences so chunks decode with their spacing
+        token_ids_per_sentence = self.encoding.encode_ordinary_batch([" " + s for s in sentences])
         
-        return chunks
+        # int32 arrays take 4 bytes per token where a list of ints takes ~36,
+        # which matters since they're kept in session state for re-chunking
+        lens = np.fromiter(map(len, token_ids_per_sentence), dtype=np.int32, count=len(token_ids_per_sentence))
+        tokens = np.fromiter(itertools.chain.from_iterable(token_ids_per_sentence), dtype=np.int32, count=int(lens.sum()))
+        return tokens, lens
+    
+    def _chunks_from_tokens(self, tokens: np.ndarray, lens: np.ndarray) -> List[str]:
+        """Pack pre-tokenized sentences into chunks and decode them"""
+        spans = _pack_chunks(lens, self.chunk_size, self.chunk_overlap)
+        chunks = [self.encoding.decode(tokens[start:end].tolist()).strip() for start, end in spans]
+        return [chunk for chunk in chunks if chunk]
     
     def _split_into_sentences(self, text: str) -> List[str]:
         """Simple sentence splitting"""
         # Basic sentence splitting on periods, exclamation marks, and question marks
-        import re
-        sentences = re.split(r'[.!?]+', text)
+        if hyperscan is not None and len(text) >= _HYPERSCAN_MIN_CHARS:
+            return self._split_into_sentences_hyperscan(text)
+        sentences = _SENT_SPLIT.split(text)
         return [s.strip() for s in sentences if s.strip()]
     
-    def _get_overlap_text(self, text: str, overlap_size: int) -> str:
-        """Get the last part of text for overlap"""
-        tokens = self.encoding.encode(text)
-        if len(tokens) <= overlap_size:
-            return text
+    def _split_into_sentences_hyperscan(self, text: str) -> List[str]:
+        """Sentence splitting for large documents using Hyperscan's DFA scanner"""
+        data = text.encode('utf-8')
+        delimiters = []
         
-        overlap_tokens = tokens[-overlap_size:]
-        return self.encoding.decode(overlap_tokens)
+        def on_match(pattern_id, start, end, flags, context):
+            # Hyperscan reports every end offset of a run like "...", so extend the open run
+            if delimiters and delimiters[-1][0] == start:
+                delimiters[-1] = (start, end)
+            else:
+                delimiters.append((start, end))
+        
+        _get_hyperscan_db().scan(data, match_event_handler=on_match)
+        
+        # Delimiters are ASCII, so slicing the UTF-8 bytes never splits a character
+        sentences = []
+        position = 0
+        for start, end in delimiters + [(len(data), len(data))]:
+            sentence = data[position:start].strip()
+            if sentence:
+                sentences.append(sentence.decode('utf-8'))
+            position = end
+        return sentences
     
     def update_chunk_size(self, chunk_size: int):
         """Update chunk size"""
-        self.chunk_size = chunk_size 
\ No newline at end of file
+        self.chunk_size = chunk_size
+
+def _extract_and_tokenize(file_bytes: bytes, filename: str) -> Dict:
+    """Extract and tokenize one document; module-level so it can run in a worker process"""
+    return DocumentProcessor().tokenize_document(file_bytes, filename)
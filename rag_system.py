@@ -1,71 +1,549 @@
+import streamlit as st
 import chromadb
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
+import faiss
+import numpy as np
+import torch
+import ollama
 import requests
+from requests.adapters import HTTPAdapter
+import asyncio
 import json
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional, Tuple
+import hashlib
+import threading
 import uuid
 import os
 
+PERSIST_DIRECTORY = "./chroma_db"
+COLLECTION_NAME = "rag_documents"
+FAISS_INDEX_PATH = os.path.join(PERSIST_DIRECTORY, "faiss.index")
+FAISS_IDS_PATH = os.path.join(PERSIST_DIRECTORY, "faiss_ids.txt")
+FAISS_META_PATH = os.path.join(PERSIST_DIRECTORY, "faiss_meta.json")
+FAISS_BINARY_INDEX_PATH = os.path.join(PERSIST_DIRECTORY, "faiss_binary.index")
+FAISS_BINARY_IDS_PATH = os.path.join(PERSIST_DIRECTORY, "faiss_binary_ids.txt")
+FAISS_BINARY_META_PATH = os.path.join(PERSIST_DIRECTORY, "faiss_binary_meta.json")
+FAISS_PQ_TEMPLATE_PATH = os.path.join(PERSIST_DIRECTORY, "faiss_pq_template.index")
+FAISS_SHADOW_PATH = os.path.join(PERSIST_DIRECTORY, "faiss_shadow.index")
+EMBEDDINGS_PATH = os.path.join(PERSIST_DIRECTORY, "embeddings.f32")
+BINARY_EMBEDDINGS_PATH = os.path.join(PERSIST_DIRECTORY, "embeddings_binary.f32")
+HNSW_M = 32  # Graph neighbours per node
+PQ_MIN_VECTORS = 10_000  # Switch from HNSW to IVF-PQ once the corpus is this large
+PQ_NLIST = 256  # Coarse IVF clusters
+PQ_M = 48  # PQ sub-quantizers, one byte of code each
+PQ_NPROBE = 16  # Clusters visited per query
+SHADOW_MERGE_THRESHOLD = 4096  # Merge new vectors into the mmapped base at this size
+ENCODE_BATCH_SIZE = 128
+RERANK_FACTOR = 4  # Candidates per requested result for lossy (PQ, binary) indexes
+OLLAMA_HOST = "http://localhost:11434"
+GENERATION_OPTIONS = {
+    "temperature": 0.7,
+    "top_p": 0.9,
+    "top_k": 40
+}
+NO_DOCUMENTS_MESSAGE = "No documents have been uploaded yet. Please upload some documents first."
+NO_RELEVANT_CHUNKS_MESSAGE = "I couldn't find any relevant information in the uploaded documents to answer your question."
+
+def _write_atomically(path: str, write):
+    """Write a file via a temporary path and rename it into place"""
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def _content_hash(text: str) -> bytes:
+    """Digest identifying chunks with identical text"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+# The factories below are cached as Streamlit resources so the model weights and
+# the ChromaDB client are materialized once per process and shared by every
+# session and rerun. They are keyed on plain strings; any cached function that
+# takes the model itself must pass hash_funcs={SentenceTransformer: id} so
+# Streamlit does not try to hash the weights.
+
+@st.cache_resource(show_spinner=False)
+def get_embedding_model(name: str) -> SentenceTransformer:
+    """Load the sentence transformer model once and share it across sessions"""
+    try:
+        if torch.cuda.is_available():
+            device = "cuda"
+        elif torch.backends.mps.is_available():
+            device = "mps"
+        else:
+            device = "cpu"
+        
+        print(f"Loading embedding model: {name} ({device})")
+        model = SentenceTransformer(name, device=device)
+        if device == "cuda":
+            # FP16 halves memory traffic and runs on tensor cores
+            model.half()
+        print("✅ Embedding model loaded successfully!")
+        return model
+    except Exception as e:
+        raise Exception(f"Failed to load embedding model: {str(e)}")
+
+@st.cache_resource(show_spinner=False)
+def get_chroma_client(path: str):
+    """Open the persistent ChromaDB client once and share it across sessions"""
+    os.makedirs(path, exist_ok=True)
+    return chromadb.PersistentClient(path=path)
+
+@st.cache_resource(show_spinner=False)
+def get_chroma_collection(path: str):
+    """Get or create the document collection on the shared ChromaDB client"""
+    try:
+        collection = get_chroma_client(path).get_or_create_collection(
+            name=COLLECTION_NAME,
+            metadata={"description": "RAG system document collection"}
+        )
+        print("✅ Vector database initialized successfully!")
+        return collection
+    except Exception as e:
+        raise Exception(f"Failed to initialize vector database: {str(e)}")
+
+class _IndexState:
+    """FAISS index and its bookkeeping, shared by every session's RAGSystem"""
+    def __init__(self):
+        self.faiss_index = None #ANN index over chunk embeddings
+        self.shadow_index = None #writable IVF-PQ index for chunks added after an mmapped load
+        self.id_map = [] #faiss position -> chroma id, None where a chunk was removed
+        self.emb_matrix = None #FP32 embeddings, row i is id_map[i]
+        self.hash_to_id = {} #content hash -> id of the indexed copy of that chunk
+        self.generation = 0 #bumped whenever positions are reassigned, invalidating snapshots
+        self.training = False #an IVF-PQ index is being trained outside the lock
+        self.lock = threading.RLock()
+
+@st.cache_resource(show_spinner=False)
+def get_index_state(index_type: str) -> _IndexState:
+    """One index per index type per process, so sessions never persist diverging copies"""
+    return _IndexState()
+
+@st.cache_data(max_entries=512, show_spinner=False, hash_funcs={SentenceTransformer: id})
+def _encode_query(model: SentenceTransformer, text: str) -> np.ndarray:
+    """Embed a question; repeated questions skip the encoder forward pass"""
+    return model.encode(
+        [text], convert_to_numpy=True, normalize_embeddings=True
+    ).astype(np.float32)
+
+@st.cache_data(ttl=10, show_spinner=False)
+def _list_ollama_models(_session: requests.Session) -> List[str]:
+    """Fetch installed Ollama models, cached briefly so reruns don't hit the server"""
+    try:
+        response = _session.get(f"{OLLAMA_HOST}/api/tags", timeout=5)
+        if response.status_code == 200:
+            models_data = response.json()
+            return [model['name'] for model in models_data.get('models', [])]
+        return []
+    except:
+        return []
+
 class RAGSystem:
-    def __init__(self, embedding_model_name: str = "all-MiniLM-L6-v2"): #using all-MiniLM-L6-v2 for embeddings
-        """Initialize the RAG system with local models"""
+    def __init__(self, embedding_model_name: str = "all-MiniLM-L6-v2", index_type: str = "hnsw"): #using all-MiniLM-L6-v2 for embeddings
+        """Initialize the RAG system with local models
+        
+        index_type is "hnsw" (float vectors, compressed to IVF-PQ as the corpus
+        grows) or "binary" (sign-binarized vectors searched by Hamming distance)
+        """
+        if index_type not in ("hnsw", "binary"):
+            raise ValueError(f"Unsupported index type: {index_type}")
         self.embedding_model_name = embedding_model_name #using all-MiniLM-L6-v2 for embeddings
+        self.index_type = index_type #faiss index flavour
         self.embedding_model = None #embedding model
         self.chroma_client = None #chroma client
-        self.collection = None #collection  
+        self._index = None #FAISS state shared by every session
         self.ollama_model = "llama2"  # Default model
         self.chunk_size = 500 #chunk size
         self.top_k = 3 #top k results   
         
+        # One keep-alive connection pool for every Ollama call
+        self._http = requests.Session()
+        self._http.mount('http://', HTTPAdapter(pool_maxsize=8, pool_block=False))
+        
         self._initialize_embedding_model()
         self._initialize_vector_db()
     
     def _initialize_embedding_model(self):
         """Initialize the sentence transformer model for embeddings"""
-        try:
-            print(f"Loading embedding model: {self.embedding_model_name}")
-            self.embedding_model = SentenceTransformer(self.embedding_model_name)
-            print("✅ Embedding model loaded successfully!")
-        except Exception as e:
-            raise Exception(f"Failed to load embedding model: {str(e)}")
+        self.embedding_model = get_embedding_model(self.embedding_model_name)
     
     def _initialize_vector_db(self):
         """Initialize ChromaDB for vector storage"""
         try:
-            # Create persistent ChromaDB client
-            persist_directory = "./chroma_db"
-            os.makedirs(persist_directory, exist_ok=True)
+            self.chroma_client = get_chroma_client(PERSIST_DIRECTORY)
+        except Exception as e:
+            raise Exception(f"Failed to initialize vector database: {str(e)}")
+        self._index = get_index_state(self.index_type)
+        with self._index.lock:
+            if self._index.faiss_index is None:
+                self._load_faiss_index()
+        self._maybe_train_pq()
+    
+    @property
+    def collection(self):
+        """The shared document collection; looked up each time so a clear in any session is seen"""
+        return get_chroma_collection(PERSIST_DIRECTORY)
+    
+    def _new_faiss_index(self):
+        """Create an empty index; embeddings are normalized so inner product is cosine"""
+        dim = self.embedding_model.get_sentence_embedding_dimension()
+        if self.index_type == "binary":
+            return faiss.IndexBinaryFlat(dim)
+        return faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    
+    def _faiss_paths(self) -> Tuple[str, str, str, str]:
+        """Index, id map, embedding matrix and metadata paths for the configured index type"""
+        if self.index_type == "binary":
+            return FAISS_BINARY_INDEX_PATH, FAISS_BINARY_IDS_PATH, BINARY_EMBEDDINGS_PATH, FAISS_BINARY_META_PATH
+        return FAISS_INDEX_PATH, FAISS_IDS_PATH, EMBEDDINGS_PATH, FAISS_META_PATH
+    
+    def _load_faiss_index(self):
+        """Load the persisted FAISS index, or rebuild it from the vectors in ChromaDB"""
+        index_path, ids_path, embeddings_path, meta_path = self._faiss_paths()
+        try:
+            if all(os.path.exists(path) for path in (index_path, ids_path, embeddings_path, meta_path)):
+                shadow_index = None
+                if self.index_type == "binary":
+                    index = faiss.read_index_binary(index_path)
+                elif os.path.exists(FAISS_PQ_TEMPLATE_PATH):
+                    # IVF-PQ: map the inverted lists read-only and let the OS page them in
+                    # on demand; new chunks go to a small writable shadow index
+                    index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                    shadow_path = FAISS_SHADOW_PATH if os.path.exists(FAISS_SHADOW_PATH) else FAISS_PQ_TEMPLATE_PATH
+                    shadow_index = faiss.read_index(shadow_path)
+                    shadow_index.nprobe = PQ_NPROBE
+                else:
+                    index = faiss.read_index(index_path)
+                with open(meta_path, 'r') as f:
+                    meta = json.load(f)
+                id_map = []
+                hash_to_id = {}
+                with open(ids_path, 'r') as f:
+                    for line in f:
+                        chunk_id, _, content_hash = line.rstrip('\n').partition(' ')
+                        if chunk_id == '-':
+                            # Removed from an IVF index; the position stays so later ones don't move
+                            id_map.append(None)
+                            continue
+                        id_map.append(chunk_id)
+                        hash_to_id[bytes.fromhex(content_hash)] = chunk_id
+                emb_matrix = self._map_emb_matrix(embeddings_path)
+                ntotal = index.ntotal + (shadow_index.ntotal if shadow_index is not None else 0)
+                # The id and embedding files are appended before the metadata is
+                # written, so an interrupted save shows up as a length mismatch.
+                # Duplicate chunks live in ChromaDB only, so compare against the saved row count
+                if (ntotal == meta['ntotal'] == len(hash_to_id)
+                        and meta['rows'] == len(id_map) == len(emb_matrix)
+                        and emb_matrix.nbytes == os.path.getsize(embeddings_path)
+                        and meta['row_count'] == self.collection.count()):
+                    if isinstance(index, faiss.IndexIVF):
+                        index.nprobe = PQ_NPROBE
+                    self._index.faiss_index = index
+                    self._index.shadow_index = shadow_index
+                    self._index.id_map = id_map
+                    self._index.hash_to_id = hash_to_id
+                    self._index.emb_matrix = emb_matrix
+                    return
+                print("⚠️ FAISS index out of sync with ChromaDB, rebuilding...")
+            
+            self._rebuild_faiss_index()
+        except Exception as e:
+            raise Exception(f"Failed to initialize FAISS index: {str(e)}")
+    
+    def _rebuild_faiss_index(self):
+        """Recreate the FAISS index from the vectors stored in ChromaDB"""
+        self._reset_faiss_index()
+        if self.collection.count() > 0:
+            records = self.collection.get(include=['embeddings', 'documents'])
             
-            self.chroma_client = chromadb.PersistentClient(path=persist_directory)
+            # Index one copy per distinct chunk text
+            rows = []
+            hashes = []
+            seen = set()
+            for i, document in enumerate(records['documents']):
+                content_hash = _content_hash(document)
+                if content_hash not in seen:
+                    seen.add(content_hash)
+                    rows.append(i)
+                    hashes.append(content_hash)
             
-            # Get or create collection
-            self.collection = self.chroma_client.get_or_create_collection(
-                name="rag_documents",
-                metadata={"description": "RAG system document collection"}
+            embeddings = np.asarray(records['embeddings'], dtype=np.float32)[rows]
+            faiss.normalize_L2(embeddings)
+            self._add_to_faiss_index([records['ids'][i] for i in rows], hashes, embeddings)
+        self._save_faiss_index()
+    
+    def _reset_faiss_index(self):
+        """Empty the FAISS index and truncate its id and embedding files"""
+        if self.index_type != "binary":
+            for path in (FAISS_PQ_TEMPLATE_PATH, FAISS_SHADOW_PATH):
+                if os.path.exists(path):
+                    os.remove(path)
+        _, ids_path, embeddings_path, _ = self._faiss_paths()
+        for path in (ids_path, embeddings_path):
+            _write_atomically(path, lambda tmp_path: open(tmp_path, 'wb').close())
+        self._index.faiss_index = self._new_faiss_index()
+        self._index.shadow_index = None
+        self._index.id_map = []
+        self._index.hash_to_id = {}
+        self._index.generation += 1
+        self._index.emb_matrix = self._map_emb_matrix(embeddings_path)
+    
+    def _compact_faiss_index(self):
+        """Rebuild a flat or graph index from the local rows that are still live"""
+        keep = [pos for pos, chunk_id in enumerate(self._index.id_map) if chunk_id is not None]
+        ids = [self._index.id_map[pos] for pos in keep]
+        hash_of = {chunk_id: content_hash for content_hash, chunk_id in self._index.hash_to_id.items()}
+        hashes = [hash_of[chunk_id] for chunk_id in ids]
+        # Copy the rows out before the embedding file is reset
+        embeddings = np.array(self._index.emb_matrix[keep], dtype=np.float32)
+        self._reset_faiss_index()
+        if ids:
+            self._add_to_faiss_index(ids, hashes, embeddings)
+    
+    def _remove_ivf_positions(self, positions: np.ndarray):
+        """Remove positions from the IVF-PQ base and shadow, keeping the trained quantizers"""
+        if len(positions) == 0:
+            return
+        if self._index.shadow_index is None:
+            self._index.faiss_index.remove_ids(positions)
+            return
+        
+        self._index.shadow_index.remove_ids(positions)
+        # The base is mapped read-only: remove from a writable copy and map it again
+        index = faiss.read_index(FAISS_INDEX_PATH)
+        if index.remove_ids(positions) > 0:
+            _write_atomically(FAISS_INDEX_PATH, lambda path: faiss.write_index(index, path))
+            self._index.faiss_index = faiss.read_index(FAISS_INDEX_PATH, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            self._index.faiss_index.nprobe = PQ_NPROBE
+    
+    def _write_id_file(self):
+        """Rewrite the id file after positions were re-pointed or removed"""
+        _, ids_path, _, _ = self._faiss_paths()
+        hash_of = {chunk_id: content_hash for content_hash, chunk_id in self._index.hash_to_id.items()}
+        
+        def write_ids(path):
+            with open(path, 'w') as f:
+                f.writelines(f"{chunk_id} {hash_of[chunk_id].hex()}\n" if chunk_id is not None else "-\n"
+                             for chunk_id in self._index.id_map)
+        
+        _write_atomically(ids_path, write_ids)
+    
+    def _unindex_chunks(self, chunk_ids: set):
+        """Drop deleted chunks from the FAISS index without re-reading ChromaDB"""
+        hash_of = {chunk_id: content_hash for content_hash, chunk_id in self._index.hash_to_id.items()
+                   if chunk_id in chunk_ids}
+        if not hash_of:
+            # Only duplicates were removed; their vectors belong to other chunks
+            return
+        
+        # Text that still has a copy in the collection keeps its vector under that copy's id
+        survivors = self.collection.get(
+            where={"content_hash": {"$in": [content_hash.hex() for content_hash in hash_of.values()]}},
+            include=['metadatas']
+        )
+        survivor_of = {}
+        for chunk_id, metadata in zip(survivors['ids'], survivors['metadatas']):
+            survivor_of.setdefault(bytes.fromhex(metadata['content_hash']), chunk_id)
+        
+        removed = []
+        for pos, chunk_id in enumerate(self._index.id_map):
+            if chunk_id not in hash_of:
+                continue
+            content_hash = hash_of[chunk_id]
+            if content_hash in survivor_of:
+                self._index.id_map[pos] = survivor_of[content_hash]
+                self._index.hash_to_id[content_hash] = survivor_of[content_hash]
+            else:
+                self._index.id_map[pos] = None
+                del self._index.hash_to_id[content_hash]
+                removed.append(pos)
+        
+        if isinstance(self._index.faiss_index, faiss.IndexIVF):
+            # IVF ids are explicit positions, so removal works in place without retraining
+            self._remove_ivf_positions(np.asarray(removed, dtype=np.int64))
+            self._write_id_file()
+        else:
+            # HNSW and flat indexes renumber on removal; rebuild from the remaining local rows
+            self._compact_faiss_index()
+    
+    def _map_emb_matrix(self, path: str) -> np.ndarray:
+        """Map the raw FP32 embedding file read-only; row i is id_map[i]"""
+        dim = self.embedding_model.get_sentence_embedding_dimension()
+        rows = os.path.getsize(path) // (dim * np.dtype(np.float32).itemsize)
+        if rows == 0:
+            # mmap can't map an empty file
+            return np.empty((0, dim), dtype=np.float32)
+        return np.memmap(path, dtype=np.float32, mode='r', shape=(rows, dim))
+    
+    def _add_to_faiss_index(self, ids: List[str], hashes: List[bytes], embeddings: np.ndarray):
+        """Append embeddings to the FAISS index, keeping id_map aligned with positions"""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        
+        # The id and embedding files are append-only, so an add costs O(new rows)
+        # and existing maps of the matrix stay valid; remapping is just a syscall
+        _, ids_path, embeddings_path, _ = self._faiss_paths()
+        with open(embeddings_path, 'ab') as f:
+            embeddings.tofile(f)
+        with open(ids_path, 'a') as f:
+            f.writelines(f"{chunk_id} {content_hash.hex()}\n" for chunk_id, content_hash in zip(ids, hashes))
+        self._index.emb_matrix = self._map_emb_matrix(embeddings_path)
+        
+        if self.index_type == "binary":
+            # One bit per dimension: 384 floats become 48 bytes
+            self._index.faiss_index.add(np.packbits(embeddings > 0, axis=1))
+        elif self._index.shadow_index is not None:
+            # The mmapped base is read-only; ids continue from the last position
+            positions = np.arange(len(self._index.id_map), len(self._index.id_map) + len(ids), dtype=np.int64)
+            self._index.shadow_index.add_with_ids(embeddings, positions)
+        elif isinstance(self._index.faiss_index, faiss.IndexIVF):
+            # Removed positions leave gaps, so ntotal can't be used as the next id
+            positions = np.arange(len(self._index.id_map), len(self._index.id_map) + len(ids), dtype=np.int64)
+            self._index.faiss_index.add_with_ids(embeddings, positions)
+        else:
+            self._index.faiss_index.add(embeddings)
+        self._index.id_map.extend(ids)
+        self._index.hash_to_id.update(zip(hashes, ids))
+        
+        if self._index.shadow_index is not None and self._index.shadow_index.ntotal >= SHADOW_MERGE_THRESHOLD:
+            self._merge_shadow_index()
+    
+    def _merge_shadow_index(self):
+        """Fold the shadow index into the on-disk base index and map it again"""
+        print(f"Merging {self._index.shadow_index.ntotal} new vectors into the IVF-PQ index...")
+        index = faiss.read_index(FAISS_INDEX_PATH)
+        faiss.merge_into(index, self._index.shadow_index, False)
+        _write_atomically(FAISS_INDEX_PATH, lambda path: faiss.write_index(index, path))
+        del index
+        
+        self._index.faiss_index = faiss.read_index(FAISS_INDEX_PATH, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        self._index.faiss_index.nprobe = PQ_NPROBE
+        self._index.shadow_index = faiss.read_index(FAISS_PQ_TEMPLATE_PATH)
+        self._index.shadow_index.nprobe = PQ_NPROBE
+        if os.path.exists(FAISS_SHADOW_PATH):
+            os.remove(FAISS_SHADOW_PATH)
+    
+    def _search_faiss_index(self, query_embedding: np.ndarray, top_k: int) -> List[Tuple[str, float]]:
+        """Return (chroma id, cosine similarity) pairs for the best matches"""
+        if isinstance(self._index.faiss_index, faiss.IndexHNSWFlat):
+            # HNSW scores are exact inner products, no rerank needed
+            scores, positions = self._index.faiss_index.search(
+                query_embedding, min(top_k, self._index.faiss_index.ntotal)
             )
-            print("✅ Vector database initialized successfully!")
-        except Exception as e:
-            raise Exception(f"Failed to initialize vector database: {str(e)}")
+            return [(self._index.id_map[pos], float(score))
+                    for pos, score in zip(positions[0], scores[0]) if pos != -1]
+        
+        # PQ and binary scores are approximate: over-fetch, then rerank with the FP32 vectors
+        if self.index_type == "binary":
+            query_codes = np.packbits(query_embedding > 0, axis=1)
+        else:
+            query_codes = query_embedding
+        _, positions = self._index.faiss_index.search(
+            query_codes, min(top_k * RERANK_FACTOR, self._index.faiss_index.ntotal)
+        )
+        positions = positions[0]
+        if self._index.shadow_index is not None and self._index.shadow_index.ntotal > 0:
+            _, shadow_positions = self._index.shadow_index.search(
+                query_codes, min(top_k * RERANK_FACTOR, self._index.shadow_index.ntotal)
+            )
+            positions = np.concatenate([positions, shadow_positions[0]])
+        return self._rerank(positions, query_embedding[0], top_k)
+    
+    def _rerank(self, positions: np.ndarray, query_embedding: np.ndarray, top_k: int) -> List[Tuple[str, float]]:
+        """Exact cosine rerank of candidate positions with one matrix-vector product"""
+        positions = positions[positions != -1]
+        if len(positions) == 0:
+            return []
+        scores = self._index.emb_matrix[positions] @ query_embedding
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k)[:top_k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best])]
+        return [(self._index.id_map[positions[i]], float(scores[i])) for i in best]
+    
+    def _maybe_train_pq(self):
+        """Replace the HNSW index with a compressed IVF-PQ index once enough vectors exist.
+        
+        Must be called without holding the index lock: k-means takes minutes at
+        this size, so it runs on a snapshot while searches keep using HNSW.
+        """
+        with self._index.lock:
+            index = self._index.faiss_index
+            # Count indexed vectors, not ChromaDB rows, which include duplicates
+            if (self._index.training or not isinstance(index, faiss.IndexHNSWFlat)
+                    or index.ntotal < PQ_MIN_VECTORS or index.d % PQ_M != 0):
+                return
+            self._index.training = True
+            generation = self._index.generation
+            # The embedding file is append-only, so this map keeps seeing the same rows
+            vectors = self._index.emb_matrix
+        
+        try:
+            print(f"Training IVF-PQ index on {len(vectors)} vectors...")
+            
+            # k-means only needs a few hundred points per cluster
+            max_train = PQ_NLIST * 256
+            if len(vectors) > max_train:
+                sample = vectors[np.random.default_rng(0).choice(len(vectors), max_train, replace=False)]
+            else:
+                sample = vectors
+            
+            index = faiss.index_factory(vectors.shape[1], f"IVF{PQ_NLIST},PQ{PQ_M}", faiss.METRIC_INNER_PRODUCT)
+            index.train(np.ascontiguousarray(sample))
+            # The trained, empty index seeds shadow indexes once the base is mmapped
+            template = faiss.clone_index(index)
+            index.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+            index.nprobe = PQ_NPROBE
+            
+            with self._index.lock:
+                if self._index.generation != generation:
+                    # Rows were renumbered or dropped meanwhile; the next add retries
+                    print("⚠️ Index changed during IVF-PQ training, keeping HNSW")
+                    return
+                # Catch up on rows added while training
+                emb_matrix = self._index.emb_matrix
+                index.add_with_ids(np.ascontiguousarray(emb_matrix[len(vectors):]),
+                                   np.arange(len(vectors), len(emb_matrix), dtype=np.int64))
+                _write_atomically(FAISS_PQ_TEMPLATE_PATH, lambda path: faiss.write_index(template, path))
+                self._index.faiss_index = index
+                self._save_faiss_index()
+            print("✅ Switched to IVF-PQ index")
+        finally:
+            with self._index.lock:
+                self._index.training = False
+    
+    def _save_faiss_index(self):
+        """Persist the FAISS index and the metadata that validates the appended id and embedding files"""
+        index_path, _, _, meta_path = self._faiss_paths()
+        # Files are replaced by rename so live memory maps keep their old pages
+        if self.index_type == "binary":
+            _write_atomically(index_path, lambda path: faiss.write_index_binary(self._index.faiss_index, path))
+        elif self._index.shadow_index is not None:
+            # The mmapped base only changes when the shadow is merged
+            _write_atomically(FAISS_SHADOW_PATH, lambda path: faiss.write_index(self._index.shadow_index, path))
+        else:
+            _write_atomically(index_path, lambda path: faiss.write_index(self._index.faiss_index, path))
+        
+        def write_meta(path):
+            with open(path, 'w') as f:
+                json.dump({
+                    'ntotal': len(self._index.hash_to_id),
+                    'rows': len(self._index.id_map),
+                    'row_count': self.collection.count()
+                }, f)
+        
+        _write_atomically(meta_path, write_meta)
     
     def check_ollama_status(self) -> bool:
         """Check if Ollama is running and accessible"""
         try:
-            response = requests.get("http://localhost:11434/api/tags", timeout=5)
+            response = self._http.get(f"{OLLAMA_HOST}/api/tags", timeout=5)
             return response.status_code == 200
         except:
             return False
     
     def get_available_models(self) -> List[str]:
         """Get list of available Ollama models"""
-        try:
-            response = requests.get("http://localhost:11434/api/tags", timeout=5)
-            if response.status_code == 200:
-                models_data = response.json()
-                return [model['name'] for model in models_data.get('models', [])]
-            return []
-        except:
-            return []
+        return _list_ollama_models(self._http)
     
     def set_model(self, model_name: str):
         """Set the Ollama model to use"""
@@ -78,40 +556,118 @@ class RAGSystem:
         if top_k:
             self.top_k = top_k
     
-    def add_documents(self, document_chunks: List[Dict], source_filename: str):
-        """Add document chunks to the vector database"""
+    def add_documents(self, document_chunks: List[Dict], source_filename: str) -> List[str]:
+        """Add document chunks to the vector database, returning the new chunk ids"""
+        return self.add_documents_bulk([(document_chunks, source_filename)])[0]
+    
+    def add_documents_bulk(self, documents: List[Tuple[List[Dict], str]]) -> List[List[str]]:
+        """Add chunks from several documents with a single embedding pass, returning each document's chunk ids"""
         try:
             texts = []
             metadatas = []
             ids = []
+            hashes = []
+            ids_per_document = []
+            
+            for document_chunks, source_filename in documents:
+                document_ids = []
+                for chunk in document_chunks:
+                    chunk_id = str(uuid.uuid4())
+                    document_ids.append(chunk_id)
+                    texts.append(chunk['content'])
+                    hashes.append(_content_hash(chunk['content']))
+                    
+                    # Enhanced metadata
+                    metadata = chunk['metadata'].copy()
+                    metadata['source_filename'] = source_filename
+                    metadata['content_hash'] = hashes[-1].hex()
+                    metadatas.append(metadata)
+                    ids.append(chunk_id)
+                ids_per_document.append(document_ids)
+            
+            if not texts:
+                return ids_per_document
             
-            for chunk in document_chunks:
-                chunk_id = str(uuid.uuid4())
-                texts.append(chunk['content'])
+            # Only embed chunks whose text isn't indexed yet; repeated boilerplate
+            # reuses the vector of the first copy. Encoding runs outside the lock
+            # against a snapshot of the index
+            first_in_batch, new_rows = self._classify_rows(hashes)
+            
+            # Generate embeddings for every file at once to fill the batch dimension
+            print(f"Generating embeddings for {len(new_rows)} chunks ({len(texts) - len(new_rows)} duplicates skipped)...")
+            embeddings = np.empty((len(texts), self._index.emb_matrix.shape[1]), dtype=np.float32)
+            encoded = set(new_rows)
+            if new_rows:
+                embeddings[new_rows] = self._encode_texts([texts[i] for i in new_rows])
+            
+            with self._index.lock:
+                # Another session may have indexed, removed or rebuilt in the
+                # meantime, so classify again against the index as it is now
+                first_in_batch, new_rows = self._classify_rows(hashes)
+                missing = [i for i in new_rows if i not in encoded]
+                if missing:
+                    embeddings[missing] = self._encode_texts([texts[i] for i in missing])
                 
-                # Enhanced metadata
-                metadata = chunk['metadata'].copy()
-                metadata['source_filename'] = source_filename
-                metadatas.append(metadata)
-                ids.append(chunk_id)
-            
-            # Generate embeddings
-            print(f"Generating embeddings for {len(texts)} chunks...")
-            embeddings = self.embedding_model.encode(texts).tolist()
-            
-            # Add to ChromaDB
-            self.collection.add(
-                embeddings=embeddings,
-                documents=texts,
-                metadatas=metadatas,
-                ids=ids
-            )
+                if len(new_rows) < len(texts):
+                    position_of = {chunk_id: pos for pos, chunk_id in enumerate(self._index.id_map)}
+                    for i, content_hash in enumerate(hashes):
+                        if content_hash in first_in_batch:
+                            embeddings[i] = embeddings[first_in_batch[content_hash]]
+                        else:
+                            embeddings[i] = self._index.emb_matrix[position_of[self._index.hash_to_id[content_hash]]]
+                
+                # ChromaDB keeps every chunk's document and metadata, FAISS serves the search
+                self.collection.add(
+                    embeddings=embeddings.tolist(),
+                    documents=texts,
+                    metadatas=metadatas,
+                    ids=ids
+                )
+                if new_rows:
+                    self._add_to_faiss_index([ids[i] for i in new_rows], [hashes[i] for i in new_rows], embeddings[new_rows])
+                self._save_faiss_index()
             
-            print(f"✅ Added {len(texts)} chunks from {source_filename} to vector database")
+            print(f"✅ Added {len(texts)} chunks from {len(documents)} file(s) to vector database")
+            self._maybe_train_pq()
+            return ids_per_document
             
         except Exception as e:
             raise Exception(f"Failed to add documents: {str(e)}")
     
+    def _classify_rows(self, hashes: List[bytes]) -> Tuple[Dict[bytes, int], List[int]]:
+        """Map each unindexed text to its first row in the batch; those rows need embedding"""
+        first_in_batch = {}
+        new_rows = []
+        for i, content_hash in enumerate(hashes):
+            if content_hash not in self._index.hash_to_id and content_hash not in first_in_batch:
+                first_in_batch[content_hash] = i
+                new_rows.append(i)
+        return first_in_batch, new_rows
+    
+    def _encode_texts(self, texts: List[str]) -> np.ndarray:
+        """Embed chunk texts as normalized FP32 rows"""
+        return self.embedding_model.encode(
+            texts,
+            batch_size=ENCODE_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+    
+    def remove_chunks(self, chunk_ids: List[str]):
+        """Remove the given chunks from the vector database"""
+        if not chunk_ids:
+            return
+        try:
+            with self._index.lock:
+                # Delete by id rather than filename: the collection is shared, so
+                # other sessions may hold chunks from files with the same name
+                self.collection.delete(ids=chunk_ids)
+                self._unindex_chunks(set(chunk_ids))
+                self._save_faiss_index()
+        except Exception as e:
+            raise Exception(f"Failed to remove chunks: {str(e)}")
+    
     def get_collection_stats(self) -> Dict:
         """Get statistics about the document collection"""
         try:
@@ -126,24 +682,39 @@ class RAGSystem:
             top_k = self.top_k
         
         try:
-            # Generate query embedding
-            query_embedding = self.embedding_model.encode([query]).tolist()
-            
-            # Search in ChromaDB
-            results = self.collection.query(
-                query_embeddings=query_embedding,
-                n_results=top_k,
-                include=['documents', 'metadatas', 'distances']
+            if self._index.faiss_index.ntotal == 0:
+                return []
+            
+            # Generate query embedding, normalized like the stored chunks
+            query_embedding = _encode_query(self.embedding_model, query)
+            
+            # Search in FAISS
+            with self._index.lock:
+                hits = self._search_faiss_index(query_embedding, top_k)
+            
+            if not hits:
+                return []
+            
+            # Fetch documents and metadata for the hits from ChromaDB
+            results = self.collection.get(
+                ids=[chunk_id for chunk_id, _ in hits],
+                include=['documents', 'metadatas']
             )
+            records = {
+                chunk_id: (document, metadata)
+                for chunk_id, document, metadata in zip(results['ids'], results['documents'], results['metadatas'])
+            }
             
-            # Format results
+            # Format results in ranking order. The collection uses Chroma's default L2
+            # space, so keep its squared-L2 scale: 2 - 2cos for normalized vectors
             relevant_chunks = []
-            if results['documents'] and results['documents'][0]:
-                for i in range(len(results['documents'][0])):
+            for chunk_id, score in hits:
+                if chunk_id in records:
+                    document, metadata = records[chunk_id]
                     relevant_chunks.append({
-                        'content': results['documents'][0][i],
-                        'metadata': results['metadatas'][0][i],
-                        'distance': results['distances'][0][i]
+                        'content': document,
+                        'metadata': metadata,
+                        'distance': 2.0 - 2.0 * score
                     })
             
             return relevant_chunks
@@ -151,17 +722,15 @@ class RAGSystem:
         except Exception as e:
             raise Exception(f"Failed to retrieve relevant chunks: {str(e)}")
     
-    def generate_response(self, query: str, context_chunks: List[Dict]) -> str:
-        """Generate response using Ollama with retrieved context"""
-        try:
-            # Prepare context from retrieved chunks
-            context = "\n\n".join([
-                f"Document: {chunk['metadata'].get('filename', 'Unknown')}\n{chunk['content']}"
-                for chunk in context_chunks
-            ])
-            
-            # Create prompt
-            prompt = f"""Based on the following context from the uploaded documents, please answer the question. If the answer cannot be found in the provided context, please say so.
+    def _build_prompt(self, query: str, context_chunks: List[Dict]) -> str:
+        """Build the LLM prompt from the question and retrieved chunks"""
+        # Prepare context from retrieved chunks
+        context = "\n\n".join([
+            f"Document: {chunk['metadata'].get('filename', 'Unknown')}\n{chunk['content']}"
+            for chunk in context_chunks
+        ])
+        
+        return f"""Based on the following context from the uploaded documents, please answer the question. If the answer cannot be found in the provided context, please say so.
 
 Context:
 {context}
@@ -169,68 +738,141 @@ Context:
 Question: {query}
 
 Answer:"""
+    
+    def _format_sources(self, context_chunks: List[Dict]) -> str:
+        """Format the source filenames appended to an answer"""
+        sources = list(set([chunk['metadata'].get('filename', 'Unknown') 
+                          for chunk in context_chunks]))
+        return f"\n\n📚 Sources: {', '.join(sources)}"
+    
+    def generate_response_stream(self, query: str, context_chunks: List[Dict]) -> Iterator[str]:
+        """Generate a response using Ollama, yielding text as tokens arrive"""
+        try:
+            prompt = self._build_prompt(query, context_chunks)
             
-            # Call Ollama API
-            response = requests.post(
-                "http://localhost:11434/api/generate",
+            # Call Ollama API; the body is NDJSON, one object per generated chunk
+            with self._http.post(
+                f"{OLLAMA_HOST}/api/generate",
                 json={
                     "model": self.ollama_model,
                     "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.7,
-                        "top_p": 0.9,
-                        "top_k": 40
-                    }
+                    "stream": True,
+                    "options": GENERATION_OPTIONS
                 },
+                stream=True,
                 timeout=60
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result.get('response', 'Sorry, I could not generate a response.')
-            else:
-                return f"Error calling Ollama API: {response.status_code}"
+            ) as response:
+                if response.status_code != 200:
+                    yield f"Error calling Ollama API: {response.status_code}"
+                    return
+                
+                generated = False
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    result = json.loads(line)
+                    # Errors after the headers (e.g. model not found, OOM) arrive as a line in the stream
+                    if result.get('error'):
+                        yield f"Error calling Ollama API: {result['error']}"
+                        return
+                    if result.get('response'):
+                        generated = True
+                        yield result['response']
+                    if result.get('done'):
+                        break
+                
+                if not generated:
+                    yield 'Sorry, I could not generate a response.'
                 
         except requests.exceptions.RequestException as e:
-            return f"Failed to connect to Ollama. Please ensure Ollama is running. Error: {str(e)}"
+            yield f"Failed to connect to Ollama. Please ensure Ollama is running. Error: {str(e)}"
         except Exception as e:
-            return f"Error generating response: {str(e)}"
+            yield f"Error generating response: {str(e)}"
     
-    def ask_question(self, question: str) -> str:
-        """Complete RAG pipeline: retrieve relevant chunks and generate answer"""
+    def generate_response(self, query: str, context_chunks: List[Dict]) -> str:
+        """Generate response using Ollama with retrieved context"""
+        return "".join(self.generate_response_stream(query, context_chunks))
+    
+    def ask_question_stream(self, question: str) -> Iterator[str]:
+        """Complete RAG pipeline, yielding the answer incrementally"""
         try:
             # Check if we have any documents
             if self.collection.count() == 0:
-                return "No documents have been uploaded yet. Please upload some documents first."
+                yield NO_DOCUMENTS_MESSAGE
+                return
             
             # Retrieve relevant chunks
             relevant_chunks = self.retrieve_relevant_chunks(question, self.top_k)
             
             if not relevant_chunks:
-                return "I couldn't find any relevant information in the uploaded documents to answer your question."
+                yield NO_RELEVANT_CHUNKS_MESSAGE
+                return
             
             # Generate response using the retrieved context
-            response = self.generate_response(question, relevant_chunks)
+            yield from self.generate_response_stream(question, relevant_chunks)
             
             # Add source information
-            sources = list(set([chunk['metadata'].get('filename', 'Unknown') 
-                              for chunk in relevant_chunks]))
-            source_info = f"\n\n📚 Sources: {', '.join(sources)}"
+            yield self._format_sources(relevant_chunks)
+            
+        except Exception as e:
+            yield f"Error processing your question: {str(e)}"
+    
+    def ask_question(self, question: str) -> str:
+        """Complete RAG pipeline: retrieve relevant chunks and generate answer"""
+        return "".join(self.ask_question_stream(question))
+    
+    async def _agenerate(self, prompt: str, client: ollama.AsyncClient) -> str:
+        """Generate a completion without blocking the event loop"""
+        result = await client.generate(
+            model=self.ollama_model,
+            prompt=prompt,
+            options=GENERATION_OPTIONS
+        )
+        return result['response'] or 'Sorry, I could not generate a response.'
+    
+    async def _aask(self, question: str, client: ollama.AsyncClient) -> str:
+        """Async RAG pipeline for a single question"""
+        try:
+            # Retrieval is CPU-bound, so run it off the event loop
+            relevant_chunks = await asyncio.to_thread(self.retrieve_relevant_chunks, question, self.top_k)
             
-            return response + source_info
+            if not relevant_chunks:
+                return NO_RELEVANT_CHUNKS_MESSAGE
+            
+            response = await self._agenerate(self._build_prompt(question, relevant_chunks), client)
+            return response + self._format_sources(relevant_chunks)
             
+        except ollama.ResponseError as e:
+            return f"Error calling Ollama API: {e.status_code}"
         except Exception as e:
             return f"Error processing your question: {str(e)}"
     
+    async def _aask_batch(self, questions: List[str]) -> List[str]:
+        """Answer several questions concurrently over one Ollama connection pool"""
+        client = ollama.AsyncClient(host=OLLAMA_HOST)
+        return await asyncio.gather(*[self._aask(q, client) for q in questions])
+    
+    def ask_questions_batch(self, questions: List[str]) -> List[str]:
+        """Answer several questions concurrently
+        
+        Generation only overlaps on the server when Ollama runs with
+        OLLAMA_NUM_PARALLEL > 1; otherwise requests queue and only retrieval
+        and network I/O overlap.
+        """
+        if not questions:
+            return []
+        if self.collection.count() == 0:
+            return [NO_DOCUMENTS_MESSAGE] * len(questions)
+        return asyncio.run(self._aask_batch(questions))
+    
     def clear_database(self):
         """Clear all documents from the database"""
         try:
-            self.chroma_client.delete_collection("rag_documents")
-            self.collection = self.chroma_client.get_or_create_collection(
-                name="rag_documents",
-                metadata={"description": "RAG system document collection"}
-            )
+            self.chroma_client.delete_collection(COLLECTION_NAME)
+            # The cached collection handle is stale once deleted
+            get_chroma_collection.clear()
+            with self._index.lock:
+                self._rebuild_faiss_index()
             print("✅ Database cleared successfully!")
         except Exception as e:
             raise Exception(f"Failed to clear database: {str(e)}") 
\ No newline at end of file